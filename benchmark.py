@@ -0,0 +1,226 @@
+"""
+Offline benchmark for the /api/generate response path.
+
+Builds a synthetic story response (no Gemini or image-tool calls) and reports
+payload sizes and serialize/compress times for the different response options,
+plus peak RSS growth per request for the image paths (each measured in a fresh
+process, covering panel creation through the compressed response body). Both
+image paths use the same JSON encoder and gzip, so only the PNG handling differs.
+
+Usage:
+    python benchmark.py [--scenes 5] [--size 512] [--repeat 20]
+"""
+import argparse
+import base64
+import json
+import multiprocessing
+import os
+import tempfile
+import threading
+import time
+from io import BytesIO
+
+from PIL import Image
+
+# Keep the story store main.py opens at import out of the working directory
+os.environ['STORY_DB_PATH'] = os.path.join(tempfile.mkdtemp(prefix='storybench-'), 'stories.db')
+
+import main
+
+
+def make_story(num_scenes):
+    """Build a formatted story plus the image entries generate() would return"""
+    paragraph = (
+        'Hero stepped into the ruined citadel, torchlight trembling across the '
+        'carved walls. "We must find the ancient artifact," he said, determination '
+        'in his eyes. Mentor lifted the crystal orb and the shadows drew back. '
+    )
+    scenes = [f"{paragraph * 4}Scene {i + 1} closes as the stones begin to sing."
+              for i in range(num_scenes)]
+    story = "\n\n".join(scenes)
+    dialogues = [
+        {'speaker': 'Hero', 'text': 'We must find the ancient artifact.'},
+        {'speaker': 'Mentor', 'text': 'Stay close, the walls are listening.'},
+    ]
+    return story, scenes, dialogues
+
+
+def make_image(size):
+    return Image.effect_noise((size, size), 48).convert('RGB')
+
+
+def make_png(size):
+    buffer = BytesIO()
+    make_image(size).save(buffer, format='PNG')
+    return buffer.getvalue()
+
+
+def timed(fn, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = fn()
+    return result, (time.perf_counter() - start) / repeat * 1000
+
+
+def serialize(payload):
+    """The app's JSON encoder: orjson when installed, else stdlib json"""
+    if main.orjson_available:
+        return main.orjson.dumps(payload)
+    return json.dumps(payload).encode('utf-8')
+
+
+def temp_file_request(size, story, num_scenes):
+    """The original path: PNG temp file -> read back -> base64 -> JSON -> gzip"""
+    with tempfile.TemporaryDirectory() as tmp:
+        result = []
+        for i in range(num_scenes):
+            path = os.path.join(tmp, f"scene_{i}.png")
+            img = make_image(size)
+            img.save(path)
+            img.close()
+            with open(path, 'rb') as f:
+                img_base64 = base64.b64encode(f.read()).decode('utf-8')
+            result.append({'image': f"data:image/png;base64,{img_base64}",
+                           'scene': story[:600], 'dialogues': []})
+        body = serialize({'story': story, 'images': result})
+        return main.compress_body(body, 'gzip')
+
+
+def in_memory_request(size, story, num_scenes):
+    """The path used by main.py: memoryview PNG -> base64 -> JSON -> gzip"""
+    images_data = []
+    try:
+        for i in range(num_scenes):
+            img = make_image(size)
+            images_data.append({'scene_index': i, 'png': main.encode_png(img),
+                                'scene': story[:600], 'dialogues': []})
+            img.close()
+        result = main.images_for_response(images_data)
+        main.release_images(images_data)
+        body = serialize({'story': story, 'images': result})
+        return main.compress_body(body, 'gzip')
+    finally:
+        main.release_images(images_data)
+
+
+def _proc_status_kb(field):
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith(field + ':'):
+                return int(line.split()[1])
+    raise KeyError(field)
+
+
+def _current_rss():
+    with open('/proc/self/statm') as f:
+        return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+
+
+def _reset_peak_rss():
+    """Reset the kernel's RSS high-water mark (VmHWM); False if not allowed"""
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def _measure_rss(name, size, story, num_scenes, results):
+    """Child process: run one request and report (ms, peak RSS above the pre-request RSS)"""
+    fn = {'temp file': temp_file_request, 'in-memory': in_memory_request}[name]
+    baseline = _current_rss()
+    exact = _reset_peak_rss()
+    peak = [baseline]
+    done = threading.Event()
+
+    def sample():
+        # Fallback when VmHWM can't be reset: poll current RSS
+        while not done.is_set():
+            peak[0] = max(peak[0], _current_rss())
+            done.wait(0.001)
+
+    sampler = None if exact else threading.Thread(target=sample, daemon=True)
+    if sampler:
+        sampler.start()
+    start = time.perf_counter()
+    fn(size, story, num_scenes)
+    ms = (time.perf_counter() - start) * 1000
+    done.set()
+    if sampler:
+        sampler.join()
+        results.put((ms, peak[0] - baseline))
+    else:
+        results.put((ms, _proc_status_kb('VmHWM') * 1024 - baseline))
+
+
+def peak_rss(name, size, story, num_scenes):
+    """Run one simulated request in a fresh process; returns (ms, peak RSS growth in bytes).
+
+    The peak is taken relative to the RSS just before the request (after
+    imports), using a reset VmHWM or, failing that, RSS sampling. Each path
+    gets its own spawned process so memory freed by one run can't be reused
+    by the other. Linux only (/proc).
+    """
+    ctx = multiprocessing.get_context('spawn')
+    results = ctx.Queue()
+    proc = ctx.Process(target=_measure_rss, args=(name, size, story, num_scenes, results))
+    proc.start()
+    result = results.get()
+    proc.join()
+    return result
+
+
+def main_benchmark():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--scenes', type=int, default=5)
+    parser.add_argument('--size', type=int, default=512, help='image width/height in pixels')
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    story, scenes, dialogues = make_story(args.scenes)
+    png = make_png(args.size)
+    data_uri = f"data:image/png;base64,{base64.b64encode(png).decode('utf-8')}"
+    images = [{'image': data_uri, 'scene': scene[:600], 'dialogues': dialogues} for scene in scenes]
+
+    payloads = {
+        'full': {'success': True, 'story_id': 'x' * 32, 'story': story, 'images': images},
+        'compact': {'success': True, 'story_id': 'x' * 32, 'story': story,
+                    'images': main.compact_images(story, images)},
+    }
+
+    print(f"Scenes: {args.scenes}  PNG: {len(png) / 1024:.1f} KB each  repeat: {args.repeat}")
+    print(f"orjson: {main.orjson_available}  brotli: {main.brotli_available}")
+    print()
+    print(f"{'schema':<8} {'encoder':<8} {'bytes':>10} {'ms':>8}")
+    bodies = {}
+    for schema, payload in payloads.items():
+        body, ms = timed(lambda: json.dumps(payload, ensure_ascii=False).encode('utf-8'), args.repeat)
+        print(f"{schema:<8} {'json':<8} {len(body):>10} {ms:>8.2f}")
+        if main.orjson_available:
+            body, ms = timed(lambda: main.orjson.dumps(payload), args.repeat)
+            print(f"{schema:<8} {'orjson':<8} {len(body):>10} {ms:>8.2f}")
+        bodies[schema] = body
+
+    print()
+    print(f"{'schema':<8} {'encoding':<8} {'bytes':>10} {'ratio':>7} {'ms':>8}")
+    encodings = ['gzip', 'br'] if main.brotli_available else ['gzip']
+    for schema, body in bodies.items():
+        print(f"{schema:<8} {'identity':<8} {len(body):>10} {1:>7.2f} {0:>8.2f}")
+        for encoding in encodings:
+            compressed, ms = timed(lambda: main.compress_body(body, encoding), args.repeat)
+            print(f"{schema:<8} {encoding:<8} {len(compressed):>10} "
+                  f"{len(compressed) / len(body):>7.2f} {ms:>8.2f}")
+
+    print()
+    print(f"{'image path':<12} {'peak RSS MB':>12} {'ms':>8}   (same encoder, gzip)")
+    if not os.path.exists('/proc/self/statm'):
+        print("peak RSS needs Linux /proc - skipped")
+        return
+    for name in ('temp file', 'in-memory'):
+        ms, peak = peak_rss(name, args.size, story, args.scenes)
+        print(f"{name:<12} {peak / (1024 * 1024):>12.2f} {ms:>8.2f}")
+
+
+if __name__ == '__main__':
+    main_benchmark()
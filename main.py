@@ -24,15 +24,32 @@ import re
 import json
 import functools
 from concurrent.futures import ThreadPoolExecutor
-from flask import Flask, render_template, request, jsonify
+from flask import Flask, render_template, request, jsonify, g
 try:
     from flask_cors import CORS  # type: ignore
     cors_available = True
 except ImportError:
     cors_available = False
     print("Warning: flask-cors not found. Install with: pip install flask-cors")
+try:
+    import orjson  # type: ignore
+    orjson_available = True
+except ImportError:
+    orjson_available = False
+    print("[INFO] orjson not found - using stdlib json. Install with: pip install orjson")
+try:
+    import brotli  # type: ignore
+    brotli_available = True
+except ImportError:
+    brotli_available = False
+    print("[INFO] brotli not found - API responses will use gzip only. Install with: pip install brotli")
+from flask.json.provider import DefaultJSONProvider
+import gzip
 import base64
 from io import BytesIO
+import sqlite3
+import threading
+import time
 
 # ------------------------
 # Initialize Flask
@@ -40,26 +57,173 @@ app = Flask(__name__)
 if cors_available:
     CORS(app)
 
+
+class OrjsonProvider(DefaultJSONProvider):
+    """Serialize jsonify() responses with orjson straight to bytes"""
+
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, default=self.default, option=orjson.OPT_NON_STR_KEYS).decode('utf-8')
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(
+            orjson.dumps(obj, default=self.default, option=orjson.OPT_NON_STR_KEYS),
+            mimetype=self.mimetype
+        )
+
+
+if orjson_available:
+    app.json = OrjsonProvider(app)
+app.json.compact = True
+
 # ------------------------
 # Initialize Gemini
 genai.configure(api_key=os.getenv("GOOGLE_API_KEY"))
 
 # Lazy load image tool to avoid issues on Vercel
 _image_tool = None
+_image_tool_lock = threading.Lock()
+# A failed load is remembered for this long so every panel of every request
+# doesn't queue on the lock and repeat a slow hub download
+IMAGE_TOOL_RETRY_SECONDS = float(os.getenv("IMAGE_TOOL_RETRY_SECONDS", 300))
+_image_tool_failed_at = None
+_image_tool_error = None
+
+def _image_tool_failure_cached():
+    return (_image_tool_failed_at is not None
+            and time.monotonic() - _image_tool_failed_at < IMAGE_TOOL_RETRY_SECONDS)
 
-@functools.lru_cache(maxsize=1)
 def load_image_tool():
-    """Lazy load image tool - only when needed"""
-    global _image_tool
-    if _image_tool is None:
-        try:
-            from smolagents import load_tool
-            _image_tool = load_tool("agents-course/text-to-image", trust_remote_code=True)
-        except Exception as e:
-            print(f"[WARNING] Could not load image tool: {e}")
-            _image_tool = None
+    """Lazy load image tool - only when needed (retried after IMAGE_TOOL_RETRY_SECONDS if it fails)"""
+    global _image_tool, _image_tool_failed_at, _image_tool_error
+    if _image_tool is not None or _image_tool_failure_cached():
+        return _image_tool
+    # The warm-up thread and a request may both ask for the tool; load it once
+    with _image_tool_lock:
+        if _image_tool is None and not _image_tool_failure_cached():
+            try:
+                from smolagents import load_tool
+                _image_tool = load_tool("agents-course/text-to-image", trust_remote_code=True)
+                _image_tool_failed_at = _image_tool_error = None
+            except Exception as e:
+                print(f"[WARNING] Could not load image tool: {e}")
+                _image_tool = None
+                _image_tool_failed_at = time.monotonic()
+                _image_tool_error = str(e)
     return _image_tool
 
+
+def get_model_candidates(model_name):
+    """Map a UI model choice to the Gemini model names to try, in order"""
+    # Use the correct, modern model names that actually exist in the API
+    # NOTE: gemini-1.5 models have been replaced with gemini-2.x models
+    if model_name == 'gemini-1.5-flash':
+        # Map old name to new flash models
+        return ['gemini-flash-latest', 'gemini-2.5-flash', 'gemini-2.0-flash', 'gemini-2.0-flash-lite']
+    elif model_name == 'gemini-1.5-pro':
+        # Map old name to new pro models
+        return ['gemini-pro-latest', 'gemini-2.5-pro', 'gemini-2.0-flash']
+    # Default fallback
+    return ['gemini-flash-latest', 'gemini-2.0-flash', 'gemini-2.0-flash-lite']
+
+
+@functools.lru_cache(maxsize=16)
+def get_gemini_model(model_name):
+    """Build (once per process) the GenerativeModel client for a model name"""
+    return genai.GenerativeModel(model_name)
+
+# ------------------------
+# In-memory image encoding
+# ------------------------
+# Panels are PNG-encoded straight into memory and passed around as memoryviews
+# of that buffer (no temp files, no re-reads).
+#
+# Image memory is bounded by admission control: once the story text is ready,
+# each /api/generate request reserves IMAGE_BYTES_PER_PANEL for every panel it
+# will draw and keeps that reservation until its response body (base64, JSON
+# and compressed copies included) has been built. Requests that can't get room
+# within IMAGE_BUDGET_WAIT_SECONDS are answered with 503.
+MAX_IMAGES_PER_REQUEST = 10
+IMAGE_PANEL_SIZE = int(os.getenv("IMAGE_PANEL_SIZE", 1024))
+IMAGE_INFLIGHT_MAX_BYTES = int(os.getenv("IMAGE_INFLIGHT_MAX_BYTES", 256 * 1024 * 1024))
+# Per-panel estimate: 2x the raw RGB bitmap (~6 MB for a 1024x1024 panel), which
+# covers the base64 string plus its share of the JSON and compressed bodies for
+# typical art PNGs (~half the bitmap). Incompressible noise panels measure about
+# 12 MB each in benchmark.py, so raise this if panels compress poorly.
+IMAGE_BYTES_PER_PANEL = int(os.getenv(
+    "IMAGE_BYTES_PER_PANEL", IMAGE_PANEL_SIZE * IMAGE_PANEL_SIZE * 3 * 2
+))
+IMAGE_BUDGET_WAIT_SECONDS = float(os.getenv("IMAGE_BUDGET_WAIT_SECONDS", 120))
+
+
+class ImageMemoryBudget:
+    """Admission counter that bounds the image bytes reserved by in-flight requests"""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.in_flight = 0
+        self._cond = threading.Condition()
+
+    def acquire(self, nbytes, timeout=None):
+        """Reserve nbytes, waiting up to timeout seconds; returns False if it won't fit"""
+        if nbytes > self.max_bytes:
+            return False
+        with self._cond:
+            if not self._cond.wait_for(lambda: self.in_flight + nbytes <= self.max_bytes, timeout=timeout):
+                return False
+            self.in_flight += nbytes
+            return True
+
+    def release(self, nbytes):
+        if nbytes <= 0:
+            return
+        with self._cond:
+            self.in_flight = max(0, self.in_flight - nbytes)
+            self._cond.notify_all()
+
+
+image_budget = ImageMemoryBudget(IMAGE_INFLIGHT_MAX_BYTES)
+
+
+class ImageBudgetExceeded(Exception):
+    """Raised when a request can't reserve image memory in time"""
+
+
+def reserve_image_memory(num_panels):
+    """Reserve image memory for the current request (released on teardown)"""
+    nbytes = num_panels * IMAGE_BYTES_PER_PANEL
+    if nbytes > image_budget.max_bytes:
+        raise ImageBudgetExceeded(
+            f"{num_panels} images need {nbytes} bytes, more than IMAGE_INFLIGHT_MAX_BYTES "
+            f"({image_budget.max_bytes}); lower num_images or raise the limit."
+        )
+    if not image_budget.acquire(nbytes, timeout=IMAGE_BUDGET_WAIT_SECONDS):
+        raise ImageBudgetExceeded("Server is busy generating other stories. Please try again shortly.")
+    g.image_reservation = g.get('image_reservation', 0) + nbytes
+
+
+def encode_png(img):
+    """PNG-encode a PIL image into memory and return a memoryview of the bytes"""
+    buffer = BytesIO()
+    img.save(buffer, format='PNG')
+    return buffer.getbuffer()
+
+
+def png_data_uri(view):
+    """Build a data: URI for the browser from PNG bytes"""
+    return f"data:image/png;base64,{base64.b64encode(view).decode('ascii')}"
+
+
+def release_images(images_data):
+    """Drop the PNG buffers held by generated images"""
+    for img_data in images_data or []:
+        view = img_data.pop('png', None)
+        if view is not None:
+            view.release()
+
 # ------------------------
 # Multi-Agent System using CrewAI (Optional - for Vercel compatibility)
 # ------------------------
@@ -220,17 +384,7 @@ Make the reader feel immersed in the story. Write as if this is going to be publ
     # Use multi-agent system approach - agents are defined and their expertise is used in prompt
     # Fast path: Use Gemini directly for speed while maintaining agent structure and roles
     try:
-        # Use the correct, modern model names that actually exist in the API
-        # NOTE: gemini-1.5 models have been replaced with gemini-2.x models
-        if model_name == 'gemini-1.5-flash':
-            # Map old name to new flash models
-            model_candidates = ['gemini-flash-latest', 'gemini-2.5-flash', 'gemini-2.0-flash', 'gemini-2.0-flash-lite']
-        elif model_name == 'gemini-1.5-pro':
-            # Map old name to new pro models
-            model_candidates = ['gemini-pro-latest', 'gemini-2.5-pro', 'gemini-2.0-flash']
-        else:
-            # Default fallback
-            model_candidates = ['gemini-flash-latest', 'gemini-2.0-flash', 'gemini-2.0-flash-lite']
+        model_candidates = get_model_candidates(model_name)
         
         # Agents are defined above (5 agents: Story Planner, Character Developer, Dialogue Writer, Scene Designer, Story Editor)
         # We use their combined expertise in the prompt for fast generation
@@ -243,7 +397,7 @@ Make the reader feel immersed in the story. Write as if this is going to be publ
         for candidate in model_candidates:
             try:
                 print(f"Initializing model: {candidate}")
-                model = genai.GenerativeModel(candidate)
+                model = get_gemini_model(candidate)
                 api_model_name = candidate
                 print(f"[OK] Model initialized: {api_model_name}")
                 break
@@ -357,7 +511,7 @@ Remember: This should read like a real book, not a script. Immerse the reader in
                 for alt_candidate in remaining_candidates:
                     try:
                         print(f"Attempting generation with: {alt_candidate}")
-                        alt_model = genai.GenerativeModel(alt_candidate)
+                        alt_model = get_gemini_model(alt_candidate)
                         alt_response = alt_model.generate_content(
                             enhanced_prompt,
                             generation_config=genai.types.GenerationConfig(
@@ -564,11 +718,14 @@ High quality, detailed, vibrant colors, dramatic lighting, professional comic bo
                 return None
             
             img = image_tool(img_prompt)
-            img_path = f"scene_{uuid.uuid4().hex[:8]}.png"
-            img.save(img_path)
-            
+            try:
+                png = encode_png(img)
+            finally:
+                img.close()
+
             return {
-                'image': img_path,
+                'scene_index': idx,
+                'png': png,
                 'scene': scene_data.get('description', ''),
                 'dialogues': scene_data.get('dialogues', [])
             }
@@ -609,31 +766,34 @@ def run_story_generation(
     # Format story with dialogues
     formatted_story = format_story_with_dialogues(story_text, scenes, character1_name, character2_name)
     
-    # Generate images
+    # Hold image memory only for image generation and response building
+    if scenes:
+        reserve_image_memory(len(scenes))
+
+    # Generate images (PNG bytes held in memory - see release_images)
     images_data = generate_images_with_dialogues(
         scenes, character1_name, character2_name,
         character1_appearance, character1_vehicle, character1_weapons,
         character2_appearance, character2_vehicle, character2_weapons,
         genre
     )
-    
-    # Convert images to base64 for JSON response
+
+    return formatted_story, images_data, scenes
+
+
+def images_for_response(images_data):
+    """Convert generated images to base64 data URIs for the JSON response"""
     result_images = []
     for img_data in images_data:
-        if img_data and 'image' in img_data:
-            try:
-                with open(img_data['image'], 'rb') as f:
-                    img_bytes = f.read()
-                    img_base64 = base64.b64encode(img_bytes).decode('utf-8')
-                    result_images.append({
-                        'image': f"data:image/png;base64,{img_base64}",
-                        'scene': img_data.get('scene', ''),
-                        'dialogues': img_data.get('dialogues', [])
-                    })
-            except Exception as e:
-                print(f"Error encoding image: {e}")
-    
-    return formatted_story, result_images
+        try:
+            result_images.append({
+                'image': png_data_uri(img_data['png']),
+                'scene': img_data.get('scene', ''),
+                'dialogues': img_data.get('dialogues', [])
+            })
+        except Exception as e:
+            print(f"Error encoding image: {e}")
+    return result_images
 
 
 def format_story_with_dialogues(story_text, scenes, char1_name, char2_name):
@@ -675,6 +835,427 @@ def format_story_with_dialogues(story_text, scenes, char1_name, char2_name):
     return formatted.strip()
 
 
+# ------------------------
+# Persistent Story Store (SQLite + FTS5)
+# ------------------------
+# Generated stories are kept locally so they can be reopened without paying
+# for another Gemini + image round trip. Vercel only allows writes to /tmp.
+STORY_DB_PATH = os.getenv(
+    "STORY_DB_PATH",
+    "/tmp/stories.db" if os.getenv("VERCEL") else "stories.db"
+)
+STORY_PAGE_SIZE = 20
+STORY_MAX_PAGE_SIZE = 100
+
+story_store_available = False
+fts_available = False
+_story_db_local = threading.local()
+
+
+def _connect_story_db():
+    """Return this thread's SQLite connection, reopening it after a fork"""
+    conn = getattr(_story_db_local, 'conn', None)
+    if conn is None or getattr(_story_db_local, 'pid', None) != os.getpid():
+        conn = sqlite3.connect(STORY_DB_PATH, timeout=10)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA foreign_keys=ON")
+        _story_db_local.conn = conn
+        _story_db_local.pid = os.getpid()
+    return conn
+
+
+def init_story_store():
+    """Create the story tables and indexes (safe to call more than once)"""
+    global story_store_available, fts_available
+    try:
+        conn = sqlite3.connect(STORY_DB_PATH, timeout=10)
+        conn.executescript("""
+            CREATE TABLE IF NOT EXISTS stories (
+                -- Explicit rowid alias: stories_fts rows point at seq, and
+                -- VACUUM never renumbers an INTEGER PRIMARY KEY
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                id TEXT NOT NULL UNIQUE,
+                created_at REAL NOT NULL,
+                model TEXT,
+                genre TEXT NOT NULL,
+                character1_name TEXT NOT NULL,
+                character2_name TEXT NOT NULL,
+                story TEXT NOT NULL,
+                scenes_json TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_stories_created
+                ON stories (created_at DESC, id DESC);
+            CREATE INDEX IF NOT EXISTS idx_stories_genre
+                ON stories (genre COLLATE NOCASE, created_at DESC, id DESC);
+            CREATE INDEX IF NOT EXISTS idx_stories_char1
+                ON stories (character1_name COLLATE NOCASE, created_at DESC, id DESC);
+            CREATE INDEX IF NOT EXISTS idx_stories_char2
+                ON stories (character2_name COLLATE NOCASE, created_at DESC, id DESC);
+
+            CREATE TABLE IF NOT EXISTS story_images (
+                story_id TEXT NOT NULL REFERENCES stories(id) ON DELETE CASCADE,
+                position INTEGER NOT NULL,
+                scene_index INTEGER NOT NULL,
+                mime TEXT NOT NULL,
+                data BLOB NOT NULL,
+                PRIMARY KEY (story_id, position)
+            );
+        """)
+        try:
+            conn.execute(
+                "CREATE VIRTUAL TABLE IF NOT EXISTS stories_fts "
+                "USING fts5(story, scenes, tokenize='porter unicode61')"
+            )
+            fts_available = True
+        except sqlite3.OperationalError as e:
+            print(f"[INFO] SQLite FTS5 not available ({e}) - story search will use LIKE")
+            fts_available = False
+        conn.commit()
+        conn.close()
+        story_store_available = True
+        print(f"[OK] Story store ready: {STORY_DB_PATH}")
+    except Exception as e:
+        print(f"[WARNING] Could not initialize story store: {e}")
+        story_store_available = False
+    return story_store_available
+
+
+def _encode_cursor(created_at, story_id):
+    raw = json.dumps([created_at, story_id]).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def _decode_cursor(cursor):
+    padded = cursor + '=' * (-len(cursor) % 4)
+    created_at, story_id = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+    return float(created_at), str(story_id)
+
+
+def save_story(story, scenes, images, model_name, genre, character1_name, character2_name):
+    """Persist a generated story, its parsed scenes and PNG images; returns the story id"""
+    if not story_store_available:
+        return None
+    story_id = uuid.uuid4().hex
+    scene_text = "\n\n".join(s.get('description', '') for s in scenes)
+    try:
+        conn = _connect_story_db()
+        with conn:
+            cur = conn.execute(
+                "INSERT INTO stories (id, created_at, model, genre, character1_name, "
+                "character2_name, story, scenes_json) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (story_id, time.time(), model_name, genre, character1_name,
+                 character2_name, story, json.dumps(scenes))
+            )
+            if fts_available:
+                conn.execute(
+                    "INSERT INTO stories_fts (rowid, story, scenes) VALUES (?, ?, ?)",
+                    (cur.lastrowid, story, scene_text)
+                )
+            conn.executemany(
+                "INSERT INTO story_images (story_id, position, scene_index, mime, data) "
+                "VALUES (?, ?, ?, ?, ?)",
+                [(story_id, position, img['scene_index'], 'image/png', img['png'])
+                 for position, img in enumerate(images)]
+            )
+        return story_id
+    except Exception as e:
+        print(f"[WARNING] Could not save story: {e}")
+        return None
+
+
+def get_story(story_id):
+    """Load a stored story with its scenes and images, or None if missing"""
+    conn = _connect_story_db()
+    row = conn.execute("SELECT * FROM stories WHERE id = ?", (story_id,)).fetchone()
+    if row is None:
+        return None
+    scenes = json.loads(row['scenes_json'])
+    images = []
+    for img in conn.execute(
+        "SELECT scene_index, mime, data FROM story_images WHERE story_id = ? ORDER BY position",
+        (story_id,)
+    ):
+        # Failed panels are skipped, so the scene comes from scene_index, not position
+        scene = scenes[img['scene_index']] if img['scene_index'] < len(scenes) else {}
+        images.append({
+            'image': f"data:{img['mime']};base64,{base64.b64encode(img['data']).decode('ascii')}",
+            'scene': scene.get('description', ''),
+            'dialogues': scene.get('dialogues', [])
+        })
+    return {
+        'id': row['id'],
+        'created_at': row['created_at'],
+        'model': row['model'],
+        'genre': row['genre'],
+        'character1_name': row['character1_name'],
+        'character2_name': row['character2_name'],
+        'story': row['story'],
+        'scenes': scenes,
+        'images': images
+    }
+
+
+def list_stories(genre=None, character=None, query=None, cursor=None, limit=STORY_PAGE_SIZE):
+    """List story summaries newest first, paginated by a (created_at, id) cursor"""
+    conn = _connect_story_db()
+    clauses, params = [], []
+    if genre:
+        clauses.append("s.genre = ? COLLATE NOCASE")
+        params.append(genre)
+    if character:
+        clauses.append("(s.character1_name = ? COLLATE NOCASE OR s.character2_name = ? COLLATE NOCASE)")
+        params.extend([character, character])
+    terms = query.split() if query else []
+    if terms:
+        if fts_available:
+            clauses.append("s.seq IN (SELECT rowid FROM stories_fts WHERE stories_fts MATCH ?)")
+            # Quote each term so user input can't inject FTS5 query syntax
+            params.append(" ".join('"' + t.replace('"', '""') + '"' for t in terms))
+        else:
+            phrase = " ".join(terms)
+            clauses.append("(s.story LIKE ? OR s.scenes_json LIKE ?)")
+            params.extend([f"%{phrase}%", f"%{phrase}%"])
+    if cursor:
+        created_at, story_id = _decode_cursor(cursor)
+        clauses.append("(s.created_at < ? OR (s.created_at = ? AND s.id < ?))")
+        params.extend([created_at, created_at, story_id])
+
+    where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+    rows = conn.execute(
+        f"""SELECT s.id, s.created_at, s.model, s.genre, s.character1_name, s.character2_name,
+                   substr(s.story, 1, 200) AS preview,
+                   (SELECT COUNT(*) FROM story_images i WHERE i.story_id = s.id) AS num_images
+            FROM stories s {where}
+            ORDER BY s.created_at DESC, s.id DESC
+            LIMIT ?""",
+        params + [limit + 1]
+    ).fetchall()
+
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    next_cursor = _encode_cursor(rows[-1]['created_at'], rows[-1]['id']) if has_more else None
+    return [dict(r) for r in rows], next_cursor
+
+
+init_story_store()
+
+
+# ------------------------
+# Lean API Responses
+# ------------------------
+# Responses carry the whole story plus base64 images, so they are compressed
+# when the client allows it. Base64 PNG data gains little from high levels,
+# so cheap settings are used to keep encode time low.
+COMPRESS_MIN_SIZE = 1024
+COMPRESS_GZIP_LEVEL = 5
+COMPRESS_BROTLI_QUALITY = 4
+COMPRESS_MIMETYPES = {'application/json', 'text/html', 'text/css', 'application/javascript', 'text/javascript'}
+
+
+def compress_body(body, encoding):
+    """Compress a response body with the given content-coding ('br' or 'gzip')"""
+    if encoding == 'br':
+        return brotli.compress(body, quality=COMPRESS_BROTLI_QUALITY)
+    return gzip.compress(body, compresslevel=COMPRESS_GZIP_LEVEL)
+
+
+def _utf16_len(text):
+    """Length of text in UTF-16 code units, i.e. JavaScript string indices"""
+    return len(text.encode('utf-16-le')) // 2
+
+
+def compact_images(story, images):
+    """Swap each image's scene text for a [start, end] span into story.
+
+    Spans are UTF-16 offsets so the browser can use story.slice(start, end).
+    Scenes that don't appear verbatim in the formatted story keep their text.
+    """
+    compacted = []
+    search_from = 0
+    for img in images:
+        scene = img.get('scene', '')
+        entry = {'image': img['image'], 'dialogues': img.get('dialogues', [])}
+        start = story.find(scene, search_from) if scene else -1
+        if start == -1 and scene:
+            start = story.find(scene)
+        if start >= 0:
+            end = start + len(scene)
+            utf16_start = _utf16_len(story[:start])
+            entry['scene_span'] = [utf16_start, utf16_start + _utf16_len(scene)]
+            search_from = end
+        else:
+            entry['scene'] = scene
+        compacted.append(entry)
+    return compacted
+
+
+@app.after_request
+def compress_response(response):
+    """Negotiate brotli/gzip compression for text and JSON responses"""
+    if (response.direct_passthrough
+            or response.status_code < 200
+            or response.status_code in (204, 304)
+            or 'Content-Encoding' in response.headers
+            or response.mimetype not in COMPRESS_MIMETYPES):
+        return response
+
+    response.vary.add('Accept-Encoding')
+    offered = ['br', 'gzip'] if brotli_available else ['gzip']
+    encoding = request.accept_encodings.best_match(offered)
+    if encoding is None:
+        return response
+
+    body = response.get_data()
+    if len(body) < COMPRESS_MIN_SIZE:
+        return response
+
+    response.set_data(compress_body(body, encoding))
+    response.headers['Content-Encoding'] = encoding
+    return response
+
+
+# ------------------------
+# Warm-up / Preload
+# ------------------------
+# WARMUP_MODE controls when the image tool and Gemini API client are loaded:
+#   off        - lazily, inside the first request that needs them (default)
+#   background - the image tool loads in a daemon thread at startup
+#   preload    - the image tool loads synchronously at import, so a pre-fork
+#                server started with `gunicorn --preload main:app` loads it once
+#                in the master and every forked worker inherits it
+# gRPC channels must not be opened before a fork, and at import time we can't
+# tell whether one is coming. So startup never opens the Gemini client; it is
+# opened in a background thread either right after a fork (in each worker, see
+# _warmup_after_fork) or when a process that didn't fork serves its first
+# request (see warm_clients_on_first_request). /readyz reports 503 until then.
+#
+# The image tool is optional (smolagents isn't a hard dependency): failing to
+# load it is reported in warmup_state but doesn't make the worker unready.
+WARMUP_MODE = os.getenv("WARMUP_MODE", "off").lower()
+WARMUP_MODELS = [m.strip() for m in os.getenv("WARMUP_MODELS", "gemini-1.5-flash").split(",") if m.strip()]
+# Minimum gap between warm-up attempts after a failure (each makes Gemini calls)
+WARMUP_RETRY_SECONDS = float(os.getenv("WARMUP_RETRY_SECONDS", 60))
+warmup_enabled = WARMUP_MODE in ('background', 'preload')
+
+warmup_state = {
+    'mode': WARMUP_MODE,
+    'ready': not warmup_enabled,
+    'running': False,
+    'pid': os.getpid(),
+    'started_at': None,
+    'finished_at': None,
+    'image_tool': False,
+    'image_tool_error': None,
+    'clients_ready': False,
+    'models': [],
+    'error': None
+}
+_warmup_lock = threading.Lock()
+
+
+def warm_gemini_clients():
+    """Open the Gemini API client for each WARMUP_MODELS choice.
+
+    count_tokens is a free call that creates the client, opens the gRPC channel
+    and authenticates - the setup the first generate_content would otherwise pay.
+    """
+    warmed = []
+    for model_name in WARMUP_MODELS:
+        last_error = None
+        for candidate in get_model_candidates(model_name):
+            try:
+                get_gemini_model(candidate).count_tokens("warm-up")
+                warmed.append(candidate)
+                break
+            except Exception as e:
+                last_error = e
+        else:
+            raise RuntimeError(f"Could not open a Gemini client for {model_name}: {last_error}")
+    return warmed
+
+
+def warmup(open_clients=True):
+    """Preload the text-to-image tool and (optionally) open the Gemini clients"""
+    warmup_state.update(running=True, started_at=time.time())
+    try:
+        warmup_state['image_tool'] = load_image_tool() is not None
+        warmup_state['image_tool_error'] = _image_tool_error
+        if open_clients:
+            try:
+                warmup_state['models'] = warm_gemini_clients()
+                warmup_state.update(clients_ready=True, error=None)
+            except Exception as e:
+                warmup_state.update(clients_ready=False, error=str(e))
+    finally:
+        warmup_state['finished_at'] = time.time()
+        warmup_state['ready'] = warmup_state['clients_ready']
+        warmup_state['running'] = False
+        took = warmup_state['finished_at'] - warmup_state['started_at']
+        if warmup_state['error']:
+            print(f"[WARNING] Warm-up failed after {took:.1f}s: {warmup_state['error']}")
+        else:
+            print(f"[OK] Warm-up step finished in {took:.1f}s "
+                  f"(image tool: {warmup_state['image_tool']}, models: {warmup_state['models']})")
+
+
+def start_warmup_thread(open_clients=True):
+    """Run warm-up in a daemon thread unless one is already running"""
+    with _warmup_lock:
+        if warmup_state['running']:
+            return
+        warmup_state['running'] = True
+    threading.Thread(target=warmup, args=(open_clients,), name='warmup', daemon=True).start()
+
+
+def ensure_clients_warming():
+    """Start opening the Gemini clients in this process if that is still pending.
+
+    Only called from a process that is serving requests, so no fork follows.
+    After a failure, attempts are spaced by WARMUP_RETRY_SECONDS.
+    """
+    if not warmup_enabled or warmup_state['clients_ready'] or warmup_state['running']:
+        return
+    if warmup_state['error'] and time.time() - warmup_state['finished_at'] < WARMUP_RETRY_SECONDS:
+        return
+    start_warmup_thread()
+
+
+def _warmup_after_fork():
+    """In a forked worker: drop inherited clients/locks and finish warm-up"""
+    global _image_tool_lock, _warmup_lock
+    _image_tool_lock = threading.Lock()
+    _warmup_lock = threading.Lock()
+    # Discard any clients inherited from the parent; gRPC state is unsafe after fork
+    genai.configure(api_key=os.getenv("GOOGLE_API_KEY"))
+    get_gemini_model.cache_clear()
+    warmup_state.update(ready=False, running=False, pid=os.getpid(),
+                        clients_ready=False, models=[], error=None)
+    start_warmup_thread()
+
+
+def start_warmup():
+    """Run the startup part of warm-up according to WARMUP_MODE"""
+    if WARMUP_MODE == 'preload':
+        warmup(open_clients=False)
+    elif WARMUP_MODE == 'background':
+        start_warmup_thread(open_clients=False)
+    elif WARMUP_MODE != 'off':
+        print(f"[WARNING] Unknown WARMUP_MODE '{WARMUP_MODE}' - skipping warm-up")
+    if warmup_enabled and hasattr(os, 'register_at_fork'):
+        os.register_at_fork(after_in_child=_warmup_after_fork)
+
+
+start_warmup()
+
+
+@app.before_request
+def warm_clients_on_first_request():
+    """A process serving requests won't fork again, so open its Gemini clients now"""
+    ensure_clients_warming()
+
+
 # ------------------------
 # Flask Routes
 # ------------------------
@@ -683,12 +1264,27 @@ def favicon():
     """Return empty response for favicon to prevent 404 errors"""
     return '', 204
 
+@app.route('/healthz')
+def healthz():
+    """Liveness: the process is up and serving requests"""
+    return jsonify({'status': 'ok'})
+
+@app.route('/readyz')
+def readyz():
+    """Readiness: the Gemini clients are open (image tool problems are only reported)"""
+    if warmup_state['ready']:
+        return jsonify({'status': 'ready', **warmup_state})
+    # Failed warm-ups are retried by warm_clients_on_first_request, rate limited
+    status = 'degraded' if warmup_state['error'] and not warmup_state['running'] else 'warming'
+    return jsonify({'status': status, **warmup_state}), 503
+
 @app.route('/')
 def index():
     return render_template('index.html')
 
 @app.route('/api/generate', methods=['POST'])
 def generate():
+    images_data = None
     try:
         data = request.json
         
@@ -705,28 +1301,97 @@ def generate():
         character2_weapons = data.get('character2_weapons', '')
         custom_prompt = data.get('custom_prompt', '')
         num_images = int(data.get('num_images', 5))
-        
-        story, images = run_story_generation(
+        compact = data.get('compact') is True
+        if not 1 <= num_images <= MAX_IMAGES_PER_REQUEST:
+            return jsonify({
+                'success': False,
+                'error': f'num_images must be between 1 and {MAX_IMAGES_PER_REQUEST}'
+            }), 400
+
+        story, images_data, scenes = run_story_generation(
             model_name, temperature, genre, character1_name, character2_name,
             character1_appearance, character1_vehicle, character1_weapons,
             character2_appearance, character2_vehicle, character2_weapons,
             custom_prompt, num_images
         )
-        
+
+        # Failed generations (API errors, fallback text) come back without scenes
+        story_id = None
+        if scenes and not story.startswith("Error:"):
+            story_id = save_story(
+                story, scenes, images_data, model_name, genre, character1_name, character2_name
+            )
+        images = images_for_response(images_data)
+        release_images(images_data)  # PNG buffers aren't needed once encoded
+
         return jsonify({
             'success': True,
+            'story_id': story_id,
             'story': story,
-            'images': images
+            'images': compact_images(story, images) if compact else images
         })
-        
+
+    except ImageBudgetExceeded as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 503
     except Exception as e:
         return jsonify({
             'success': False,
             'error': str(e)
         }), 500
+    finally:
+        release_images(images_data)
+
+@app.teardown_request
+def release_image_reservation(exc):
+    """Return a request's image budget once its response body has been built"""
+    image_budget.release(g.pop('image_reservation', 0))
+
+@app.route('/api/stories', methods=['GET'])
+def stories():
+    """List stored stories, filterable by genre/character and full-text query"""
+    if not story_store_available:
+        return jsonify({'success': False, 'error': 'Story store not available'}), 503
+    try:
+        limit = int(request.args.get('limit', STORY_PAGE_SIZE))
+        limit = max(1, min(limit, STORY_MAX_PAGE_SIZE))
+        items, next_cursor = list_stories(
+            genre=request.args.get('genre'),
+            character=request.args.get('character'),
+            query=request.args.get('q'),
+            cursor=request.args.get('cursor'),
+            limit=limit
+        )
+    except (ValueError, TypeError) as e:
+        return jsonify({'success': False, 'error': f'Invalid parameter: {e}'}), 400
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+    return jsonify({
+        'success': True,
+        'stories': items,
+        'next_cursor': next_cursor
+    })
+
+@app.route('/api/stories/<story_id>', methods=['GET'])
+def story_detail(story_id):
+    """Reopen a stored story without regenerating it"""
+    if not story_store_available:
+        return jsonify({'success': False, 'error': 'Story store not available'}), 503
+    try:
+        stored = get_story(story_id)
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+    if stored is None:
+        return jsonify({'success': False, 'error': 'Story not found'}), 404
+    return jsonify({'success': True, **stored})
 
 # Launch the Flask app
 if __name__ == "__main__":
     port = int(os.getenv("PORT", 7860))
     debug = os.getenv("FLASK_DEBUG", "False").lower() == "true"
+    # No pre-fork server here, so open the Gemini clients in this process now
+    ensure_clients_warming()
     app.run(host="0.0.0.0", port=port, debug=debug)
@@ -218,7 +218,8 @@ document.getElementById('storyForm').addEventListener('submit', async (e) => {
         character2_vehicle: document.getElementById('character2_vehicle').value,
         character2_weapons: document.getElementById('character2_weapons').value,
         custom_prompt: document.getElementById('custom_prompt').value,
-        num_images: parseInt(document.getElementById('num_images').value)
+        num_images: parseInt(document.getElementById('num_images').value),
+        compact: true
     };
     
     // Show loading
@@ -264,7 +265,10 @@ document.getElementById('storyForm').addEventListener('submit', async (e) => {
                 sceneInfo.appendChild(h4);
                 
                 const p = document.createElement('p');
-                p.textContent = img.scene;
+                // Compact responses reference the scene text inside the story
+                p.textContent = img.scene_span
+                    ? data.story.slice(img.scene_span[0], img.scene_span[1])
+                    : img.scene;
                 sceneInfo.appendChild(p);
                 
                 // Add dialogues if available